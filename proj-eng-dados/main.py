@@ -1,12 +1,19 @@
-import requests
-import json
+import asyncio
+import hashlib
+import httpx
+import math
+import orjson
+from concurrent.futures import ProcessPoolExecutor
 import os                     
-import pandas as pd
+import shutil
+import time
 from pathlib import Path
 from dotenv import load_dotenv
 import pyarrow.dataset as ds 
 import pyarrow.parquet as pq
 import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.feather as feather
 
 
 # --- Configuração ---
@@ -25,6 +32,13 @@ TABLE_NAME = "gastos"
 
 API_URL = f"https://api.brasil.io/v1/dataset/{DATASET_SLUG}/{TABLE_NAME}/data/"
 
+# Número máximo de requisições simultâneas à API
+MAX_CONCURRENT_REQUESTS = 8
+
+# Páginas sem ETag baixadas há menos que esse intervalo (em segundos) não são pedidas de novo.
+# Isso permite retomar uma coleta interrompida quando a API não envia ETag.
+RAW_REFRESH_INTERVAL = 24 * 60 * 60
+
 # Define os caminhos das pastas usando pathlib
 BASE_DIR = Path(__file__).resolve().parent
 RAW_PATH = BASE_DIR / "dataset" / "raw"
@@ -38,125 +52,355 @@ BRONZE_PATH.mkdir(parents=True, exist_ok=True)
 SILVER_PATH.mkdir(parents=True, exist_ok=True)  
 GOLD_PATH.mkdir(parents=True, exist_ok=True)  
 
+# Colunas da Bronze usadas na camada Silver. Elas são também o esquema publicado da Silver:
+# as demais colunas da API (codigo_* etc.) não são levadas adiante e ficam apenas na Raw/Bronze.
+SILVER_COLUMNS = [
+    'ano',
+    'mes',
+    'valor',
+    'nome_orgao',
+    'nome_favorecido',
+    'nome_acao',
+    'nome_programa',
+    'nome_funcao',
+    'nome_grupo_despesa',
+    'data_pagamento'
+]
+
+# Tipos declarados das colunas das páginas da API (camada Raw). Não há um esquema fixo para as páginas:
+# cada uma tem os tipos inferidos e depois convertidos para estes; se a conversão falhar
+# (ex.: 'valor' vindo como texto), a página mantém o tipo inferido (ver _raw_table).
+# 'valor' fica em float64 na Raw e na Bronze: a redução para float32 acontece só na Silver.
+RAW_FIELD_TYPES = {
+    'ano': pa.int16(),
+    'mes': pa.int8(),
+    'valor': pa.float64(),
+    'data_pagamento': pa.large_string(),
+    'nome_orgao': pa.large_string(),
+    'nome_favorecido': pa.large_string(),
+    'nome_acao': pa.large_string(),
+    'nome_programa': pa.large_string(),
+    'nome_funcao': pa.large_string(),
+    'nome_grupo_despesa': pa.large_string()
+}
+
+# Particionamento hive (ano=YYYY/mes=MM) usado nas camadas Bronze, Silver e Gold
+PARTITIONING = ds.partitioning(
+    pa.schema([("ano", pa.int16()), ("mes", pa.int8())]),
+    flavor="hive"
+)
+
 
 def fetch_and_save_raw_data():
-    # Busca os dados da API, tratando a paginação, e as páginas como arquivos JSON na pasta 'raw'.
+    # Busca os dados da API, tratando a paginação, e salva os resultados de cada página como Arrow IPC (Feather) na pasta 'raw'.
+    # As páginas são baixadas em paralelo (limitado por MAX_CONCURRENT_REQUESTS) sobre uma única conexão HTTP/2.
+    # Retorna o conjunto de partições (ano, mes) que a Gold ainda precisa recalcular: as afetadas pelas
+    # páginas novas ou alteradas nesta execução e as que ficaram pendentes em execuções anteriores.
 
     print(f"Iniciando busca de dados da API: {DATASET_SLUG}/{TABLE_NAME}...")
+    asyncio.run(_fetch_all_pages())
+    print("Busca de dados brutos concluída.")
 
-    headers = {"Authorization": f"Token {API_TOKEN}"}  # Token de autenticação
-    url = API_URL
-    page_count = 1
-
-    # Verifica páginas já baixadas
-    paginas_existentes = {
-        int(f.stem.split('_')[-1])
-        for f in RAW_PATH.glob(f"{DATASET_SLUG}_{TABLE_NAME}_page_*.json")
-    }
+    particoes_pendentes = _pending_gold_partitions()
+    print(f"Partições (ano, mes) alteradas: {len(particoes_pendentes)}")
+    return particoes_pendentes
 
-    while url:
-        # pula páginas já baixadas
-        if page_count in paginas_existentes:
-            print(f"Página {page_count} já existente. Pulando...")
-            page_count += 1
-            url = f"{API_URL}?page={page_count}"
-            continue
 
-        try:
-            response = requests.get(url, headers=headers)
-            if response.status_code == 429:
-                print("  Rate limit atingido. Aguardando 15 segundos...")
-                import time
-                time.sleep(15)
-                continue
+async def _fetch_all_pages():
+    headers = {"Authorization": f"Token {API_TOKEN}"}  # Token de autenticação
 
-            response.raise_for_status()
-            data = response.json()
+    # O semáforo limita as requisições simultâneas; o delay é feito dentro dele,
+    # então o orçamento de rate limit é global e não por requisição.
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+
+    # A decodificação do JSON e a conversão para Arrow rodam em outros processos,
+    # sem bloquear o event loop nem disputar o GIL com os downloads.
+    loop = asyncio.get_running_loop()
+
+    # Limita as páginas em memória (baixadas e ainda não salvas): se a decodificação ficar
+    # para trás, novos downloads esperam em vez de acumular respostas sem limite.
+    paginas_em_memoria = asyncio.Semaphore(2 * MAX_CONCURRENT_REQUESTS)
+
+    with ProcessPoolExecutor() as pool:
+        async with httpx.AsyncClient(http2=True, headers=headers, timeout=60) as client:
+            # A primeira página informa o total de registros e o tamanho da página
+            response = await _fetch_page(client, semaphore, 1)
+            if response is None:
+                return
+
+            try:
+                data = orjson.loads(response.content)
+            except orjson.JSONDecodeError as e:
+                print(f"Erro ao decodificar a página 1: {e}")
+                return
             results = data.get("results", [])
-
             if not results:
                 print("Nenhum resultado encontrado nesta página. Encerrando coleta.")
-                break
+                return
+
+            # Cada página tem o próprio esquema; a Bronze reconcilia os tipos entre as páginas
+            try:
+                _save_raw_page(1, data, response.headers.get("ETag"))
+            except pa.ArrowException as e:
+                print(f"Erro ao converter a página 1: {e}")
+                return
+
+            total_paginas = math.ceil(data.get("count", len(results)) / len(results))
+            print(f"Total de páginas: {total_paginas}")
+
+            async def fetch_and_save(page):
+                # Páginas já baixadas são pedidas com If-None-Match: se não mudaram, a API responde 304 sem corpo
+                meta = _load_raw_meta(page)
+                etag = meta.get("etag")
+                if not etag and time.time() - meta.get("baixada_em", 0) < RAW_REFRESH_INTERVAL:
+                    print(f"Página {page} baixada recentemente (sem ETag). Pulando...")
+                    return
+
+                async with paginas_em_memoria:
+                    response = await _fetch_page(client, semaphore, page, etag)
+                    if response is None:
+                        return
+                    if response.status_code == 304:
+                        print(f"Página {page} não modificada. Pulando...")
+                        return
+                    await loop.run_in_executor(
+                        pool, _decode_and_save_raw_page, page, response.content, response.headers.get("ETag")
+                    )
+
+            await asyncio.gather(*[fetch_and_save(page) for page in range(2, total_paginas + 1)])
+
+
+async def _fetch_page(client, semaphore, page, etag=None):
+    # Retorna a resposta da página (200 ou 304), ou None em caso de erro na API.
+    headers = {"If-None-Match": etag} if etag else None
+    async with semaphore:
+        while True:
+            try:
+                response = await client.get(API_URL, params={"page": page}, headers=headers)
+                if response.status_code == 429:
+                    try:
+                        retry_after = float(response.headers.get("Retry-After", 15))
+                    except ValueError:
+                        retry_after = 15
+                    print(f"  Rate limit atingido (página {page}). Aguardando {retry_after:.0f} segundos...")
+                    await asyncio.sleep(retry_after)
+                    continue
+
+                if response.status_code != 304:
+                    response.raise_for_status()
+            except httpx.HTTPError as e:
+                print(f"Erro ao acessar a API (página {page}): {e}")
+                return None
+
+            await asyncio.sleep(1)  # Delay entre as requisições
+            return response
+
+
+def _decode_and_save_raw_page(page, content, etag):
+    # Executado no pool de processos: decodifica o JSON da página e salva em Feather.
+    # Uma página com dados que não podem ser convertidos é ignorada sem interromper a coleta.
+    try:
+        data = orjson.loads(content)
+        if data.get("results"):
+            _save_raw_page(page, data, etag)
+    except (orjson.JSONDecodeError, pa.ArrowException) as e:
+        print(f"Erro ao converter a página {page}: {e}")
+
+
+def _raw_table(results):
+    # Converte os resultados de uma página em tabela Arrow com tipos inferidos na própria página
+    # e ajustados com RAW_FIELD_TYPES quando a conversão não perde informação.
+    # Um esquema fixo (from_pylist(..., schema=...)) não é usado: a inferência custa praticamente
+    # o mesmo, e o esquema fixo descarta colunas novas e trunca floats em colunas inteiras sem avisar.
+    try:
+        table = pa.Table.from_pylist(results)
+    except pa.ArrowException:
+        # Coluna com tipos misturados (ex.: números e textos): as colunas problemáticas viram texto
+        colunas = {}
+        for name in dict.fromkeys(k for row in results for k in row):
+            valores = [row.get(name) for row in results]
+            try:
+                colunas[name] = pa.array(valores)
+            except pa.ArrowException:
+                colunas[name] = pa.array([None if v is None else str(v) for v in valores], pa.large_string())
+        table = pa.table(colunas)
+
+    for name, tipo in RAW_FIELD_TYPES.items():
+        if name in table.column_names and table.schema.field(name).type != tipo:
+            coluna = table[name]
+            if name in PARTITIONING.schema.names and (
+                pa.types.is_string(coluna.type) or pa.types.is_large_string(coluna.type)
+            ):
+                # Sem ano/mes inteiros não há partição: textos como 'N/D' viram nulos
+                # (e são barrados pelos testes de qualidade da Silver)
+                coluna = pc.utf8_trim_whitespace(coluna)
+                coluna = pc.if_else(pc.match_substring_regex(coluna, r'^[-+]?\d+$'), coluna, pa.scalar(None, coluna.type))
+            try:
+                coluna = pc.cast(coluna, tipo)
+            except pa.ArrowException:
+                continue
+            table = table.set_column(table.schema.get_field_index(name), name, coluna)
+    return table
 
-            # Salva JSON bruto
-            filename = f"{DATASET_SLUG}_{TABLE_NAME}_page_{page_count}.json"
-            filepath = RAW_PATH / filename
 
-            with open(filepath, "w", encoding="utf-8") as f:
-                json.dump(data, f, ensure_ascii=False, indent=4)
+def _raw_page_path(page):
+    return RAW_PATH / f"{DATASET_SLUG}_{TABLE_NAME}_page_{page}.arrow"
 
-            print(f"Página {page_count} salva em {filepath}")
 
-            # próxima página
-            url = data.get("next")
-            page_count += 1
+def _load_raw_meta(page):
+    # Metadados salvos junto da página (count, next, etag, hash, partições dos resultados,
+    # partições pendentes na Gold e horário do download), ou {} se ainda não baixada
+    meta_path = _raw_page_path(page).with_suffix(".meta.json")
+    if not meta_path.exists():
+        return {}
+    return orjson.loads(meta_path.read_bytes())
 
-            import time
-            time.sleep(1)  # Delay entre as requisições
 
-        except requests.exceptions.RequestException as e:
-            print(f"Erro ao acessar a API: {e}")
-            break
+def _write_raw_meta(page, meta):
+    _raw_page_path(page).with_suffix(".meta.json").write_bytes(orjson.dumps(meta))
 
-    print("Busca de dados brutos concluída.")
+
+def _save_raw_page(page, data, etag=None):
+    # Salva os resultados da página direto em Feather (evita reler e decodificar JSON na Bronze)
+    # e registra no .meta.json as partições (ano, mes) que a Gold precisa recalcular.
+    filepath = _raw_page_path(page)
+    meta_anterior = _load_raw_meta(page)
+
+    # Para APIs sem ETag, o hash dos resultados identifica páginas que não mudaram
+    results_hash = hashlib.blake2b(orjson.dumps(data["results"])).hexdigest()
+    if filepath.exists() and meta_anterior.get("hash") == results_hash:
+        # O conteúdo não mudou, mas o ETag pode ser novo: ele é guardado para o próximo If-None-Match
+        _write_raw_meta(page, {**meta_anterior, "etag": etag, "baixada_em": time.time()})
+        print(f"Página {page} não modificada. Pulando...")
+        return
+
+    table = _raw_table(data["results"])
+    particoes = _partitions_of(table)
+
+    # A Gold precisa recalcular as partições da versão anterior e da nova versão da página
+    # (e as que já estavam pendentes, se a Gold ainda não foi atualizada desde então)
+    pendentes = (
+        particoes
+        | {tuple(p) for p in meta_anterior.get("particoes", [])}
+        | {tuple(p) for p in meta_anterior.get("particoes_gold_pendentes", [])}
+    )
+
+    # As partições pendentes são registradas antes de gravar o Feather: se a gravação falhar no meio,
+    # nenhuma página fica na Raw sem que a Gold saiba. O hash e o ETag antigos são mantidos até o fim,
+    # então a página é baixada de novo na próxima execução.
+    _write_raw_meta(page, {**meta_anterior, "particoes_gold_pendentes": sorted(pendentes)})
+    tmp_path = filepath.with_name(filepath.name + ".tmp")
+    feather.write_feather(table, tmp_path, compression="zstd")
+    os.replace(tmp_path, filepath)
+
+    # Metadados da paginação ficam em um arquivo separado
+    meta = {
+        "count": data.get("count"),
+        "next": data.get("next"),
+        "etag": etag,
+        "hash": results_hash,
+        "particoes": sorted(particoes),
+        "particoes_gold_pendentes": sorted(pendentes),
+        "baixada_em": time.time()
+    }
+    _write_raw_meta(page, meta)
+
+    print(f"Página {page} salva em {filepath}")
+
+
+def _raw_meta_files():
+    return RAW_PATH.glob(f"{DATASET_SLUG}_{TABLE_NAME}_page_*.meta.json")
+
+
+def _pending_gold_partitions():
+    # Partições (ano, mes) afetadas por páginas salvas desde a última gravação bem-sucedida da Gold.
+    # Ficam no .meta.json de cada página, então sobrevivem a uma execução interrompida.
+    pendentes = set()
+    for meta_path in _raw_meta_files():
+        pendentes |= {tuple(p) for p in orjson.loads(meta_path.read_bytes()).get("particoes_gold_pendentes", [])}
+    return pendentes
+
+
+def _clear_pending_gold_partitions():
+    # Chamada só depois que a Gold foi gravada com sucesso
+    for meta_path in _raw_meta_files():
+        meta = orjson.loads(meta_path.read_bytes())
+        if meta.pop("particoes_gold_pendentes", None):
+            meta_path.write_bytes(orjson.dumps(meta))
+
+
+def _partitions_of(table):
+    # Pares (ano, mes) distintos presentes na tabela; valores que não são inteiros (ex.: 'N/D') são ignorados
+    if not {'ano', 'mes'}.issubset(table.column_names):
+        return set()
+    pares = table.group_by(['ano', 'mes']).aggregate([])
+    particoes = set()
+    for ano, mes in zip(pares['ano'].to_pylist(), pares['mes'].to_pylist()):
+        try:
+            particoes.add((int(ano), int(mes)))
+        except (TypeError, ValueError):
+            continue
+    return particoes
 
 
 def process_raw_to_bronze():
-    # Lê todos os arquivos JSON da pasta 'raw', transforma em Parquet e salva na pasta 'bronze', particionado por ano e mês.
+    # Lê todos os arquivos Feather da pasta 'raw', transforma em Parquet e salva na pasta 'bronze', particionado por ano e mês.
     
     print("\nIniciando processamento para a camada Bronze...")
 
-    json_files = sorted(RAW_PATH.glob(f"{DATASET_SLUG}_{TABLE_NAME}_page_*.json"))
-    if not json_files:
-        print("Nenhum arquivo JSON encontrado na pasta 'raw'.")
+    arrow_files = sorted(RAW_PATH.glob(f"{DATASET_SLUG}_{TABLE_NAME}_page_*.arrow"))
+    if not arrow_files:
+        print("Nenhum arquivo Feather encontrado na pasta 'raw'.")
         return
 
-    all_data = []
-    for file in json_files:
-        try:
-            with open(file, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                if "results" in data:
-                    all_data.extend(data["results"])
-        except json.JSONDecodeError as e:
-            print(f"Erro ao ler o arquivo {file}: {e}")
-        except Exception as e:
-            print(f"Erro inesperado ao processar {file}: {e}")
-
-    if not all_data:
+    try:
+        # Cada página tem o próprio esquema; a leitura usa um esquema comum a todas
+        dataset = ds.dataset(
+            [str(f) for f in arrow_files], format="feather", schema=_unified_raw_schema(arrow_files)
+        )
+        total_registros = dataset.count_rows()
+    except Exception as e:
+        print(f"Erro ao ler os arquivos da pasta 'raw': {e}")
+        return
+
+    if total_registros == 0:
         print("Nenhum dado para processar.")
         return
 
-    # Converte para DataFrame
-    df = pd.DataFrame(all_data)
-    print(f"Total de registros consolidados: {len(df)}")
+    print(f"Total de registros consolidados: {total_registros}")
 
     # Verifica colunas de partição
     partition_cols = ['ano', 'mes']
-    if not all(col in df.columns for col in partition_cols):
-        print(f"Erro: O DataFrame não contém as colunas de partição esperadas ({partition_cols}).")
-        print(f"Colunas disponíveis: {df.columns.to_list()}")
+    if not all(col in dataset.schema.names for col in partition_cols):
+        print(f"Erro: A tabela não contém as colunas de partição esperadas ({partition_cols}).")
+        print(f"Colunas disponíveis: {dataset.schema.names}")
         return
 
-    # Converte tipos
-    try:
-        df['ano'] = df['ano'].astype(int)
-        df['mes'] = df['mes'].astype(int)
-    except Exception as e:
-        print(f"Aviso: Não foi possível converter colunas 'ano' e 'mes' para inteiro. {e}")
+    # Converte tipos lote a lote, durante a leitura: nunca há mais de um lote em memória
+    columns = {name: ds.field(name) for name in dataset.schema.names}
+    for col in partition_cols:
+        columns[col] = ds.field(col).cast(PARTITIONING.schema.field(col).type)
+    scanner = dataset.scanner(columns=columns)
 
     # Salva em Parquet particionado por ano/mês
     print(f"Salvando dados na camada Bronze ({BRONZE_PATH})...")
 
     try:
-        df.to_parquet(
+        # A Bronze é refeita por inteiro a partir da Raw
+        _write_layer(
+            scanner,
             BRONZE_PATH,
-            engine='pyarrow',
-            compression='snappy',
-            partition_cols=partition_cols
+            # Bronze é gravada uma única vez com textos brutos e de alta cardinalidade:
+            # sem dicionário e com zstd leve, a escrita fica bem mais rápida
+            file_options=ds.ParquetFileFormat().make_write_options(
+                compression='zstd', compression_level=1, use_dictionary=False
+            ),
+            max_rows_per_file=512_000,
+            max_rows_per_group=512_000
         )
         print("Processamento para Bronze concluído com sucesso!")
         print(f"Dados salvos particionados em: {BRONZE_PATH}")
+        return True
 
     except Exception as e:
         print(f"Erro ao salvar arquivo Parquet: {e}")
@@ -164,24 +408,84 @@ def process_raw_to_bronze():
             print("Dica: Este erro pode ocorrer se o BRONZE_PATH estiver vazio ou incorreto.")
 
 
-def run_data_quality_tests(df):
+def _unified_raw_schema(arrow_files):
+    # Esquema comum às páginas da Raw: tipos compatíveis são promovidos (null → int64 → double)
+    # e colunas com tipos incompatíveis entre páginas ficam como texto
+    tipos = {}
+    for f in arrow_files:
+        for field in pa.ipc.open_file(str(f)).schema:
+            tipos.setdefault(field.name, set()).add(field.type)
+
+    fields = []
+    for name, tipos_coluna in tipos.items():
+        try:
+            field = pa.unify_schemas(
+                [pa.schema([(name, tipo)]) for tipo in tipos_coluna], promote_options="permissive"
+            ).field(name)
+        except pa.ArrowException:
+            field = pa.field(name, pa.large_string())
+        fields.append(field)
+    return pa.schema(fields)
+
+
+def _write_layer(data, path, **write_options):
+    # Refaz uma camada inteira sem deixá-la pela metade: grava em uma pasta temporária ao lado
+    # e só então troca as pastas. Se a gravação falhar, a versão anterior continua no lugar.
+    tmp_path = path.with_name(path.name + ".tmp")
+    old_path = path.with_name(path.name + ".old")
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+    try:
+        ds.write_dataset(data, tmp_path, format="parquet", partitioning=PARTITIONING, **write_options)
+    except Exception:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+    # Partições que deixaram de existir somem junto com a pasta antiga
+    if path.exists():
+        os.replace(path, old_path)
+    os.replace(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+
+def run_data_quality_tests(table):
     """
-    Executa um conjunto simples de testes de qualidade de dados (Data Quality).
+    Executa um conjunto simples de testes de qualidade de dados (Data Quality)
+    sobre uma tabela Arrow (pa.Table).
     Gera um erro (AssertionError) se um teste falhar.
     """
     print("Executando testes de qualidade de dados (Data Quality Checks)...")
 
     # Teste 1: Colunas críticas não devem ter valores nulos
     critical_cols = ['ano', 'mes', 'nome_orgao', 'nome_favorecido']
-    for col in critical_cols:
-        assert col in df.columns, f"Coluna crítica '{col}' não encontrada no dataset."
-        assert df[col].notna().all(), f"Coluna crítica '{col}' possui valores nulos."
+    for col in critical_cols + ['valor']:
+        assert col in table.column_names, f"Coluna crítica '{col}' não encontrada no dataset."
+
+    checks = [(f"Coluna crítica '{col}' possui valores nulos.", pc.is_valid(table[col])) for col in critical_cols]
 
     # Teste 2: Valores de mês devem estar entre 1 e 12
-    assert df['mes'].between(1, 12).all(), "Valores inválidos encontrados na coluna 'mes'."
+    checks.append((
+        "Valores inválidos encontrados na coluna 'mes'.",
+        pc.and_(pc.greater_equal(table['mes'], 1), pc.less_equal(table['mes'], 12))
+    ))
 
     # Teste 3: Valores monetários não devem ser negativos
-    assert (df['valor'] >= 0).all(), "Valores negativos encontrados na coluna 'valor'."
+    checks.append((
+        "Valores negativos encontrados na coluna 'valor'.",
+        pc.greater_equal(table['valor'], 0)
+    ))
+
+    # Cada predicado já foi calculado acima (uma máscara booleana por teste); elas são
+    # combinadas em uma só e reduzidas com um único pc.all. As reduções individuais,
+    # que identificam qual teste falhou, só acontecem em caso de falha.
+    combined = checks[0][1]
+    for _, predicate in checks[1:]:
+        combined = pc.and_kleene(combined, predicate)
+
+    if not pc.all(combined, skip_nulls=False, min_count=0).as_py():
+        for message, predicate in checks:
+            assert pc.all(predicate, skip_nulls=False, min_count=0).as_py(), message
 
     print(" Testes de qualidade aprovados!")
 
@@ -195,22 +499,31 @@ def process_bronze_to_silver():
     print("Iniciando processamento para a camada Silver (Limpeza e Padronização)...")
     
     try:
-        df = pd.read_parquet(BRONZE_PATH)
+        # Só as colunas usadas na Silver são lidas do disco
+        dataset = ds.dataset(BRONZE_PATH, format="parquet", partitioning=PARTITIONING)
+        tbl = dataset.to_table(columns=[col for col in SILVER_COLUMNS if col in dataset.schema.names])
     except Exception as e:
         print(f"Erro ao ler dados da camada Bronze: {e}")
         return
 
-    if df.empty:
+    if tbl.num_rows == 0:
         print("Nenhum dado encontrado na camada Bronze.")
         return
 
-    # --- Limpeza e Padronização ---
-
-    df_silver = df.copy()
+    # --- Limpeza e Padronização (kernels vetorizados do Arrow) ---
 
     # REGRA 1: TRATAR VALORES NULOS
-    if 'valor' in df_silver.columns:
-        df_silver['valor'] = pd.to_numeric(df_silver['valor'], errors='coerce').fillna(0)
+    if 'valor' in tbl.column_names:
+        valor = tbl['valor']
+        if pa.types.is_string(valor.type) or pa.types.is_large_string(valor.type):
+            # Textos que não representam números viram nulos (como no pd.to_numeric(errors='coerce'))
+            valor = pc.utf8_trim_whitespace(valor)
+            numerico = pc.match_substring_regex(valor, r'^[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?$')
+            valor = pc.if_else(numerico, valor, pa.scalar(None, valor.type))
+
+        # float32 é suficiente para os valores monetários deste uso e ocupa metade do espaço
+        valor = pc.fill_null(pc.cast(valor, pa.float32(), safe=False), 0.0)
+        tbl = tbl.set_column(tbl.schema.get_field_index('valor'), 'valor', valor)
 
     # REGRA 2: PADRONIZAÇÃO DE TEXTO
     text_cols = [
@@ -222,101 +535,180 @@ def process_bronze_to_silver():
         'nome_grupo_despesa'
     ]
     for col in text_cols:
-        if col in df_silver.columns:
-            df_silver[col] = df_silver[col].astype(str).str.upper().str.strip()
+        if col in tbl.column_names:
+            texto = pc.utf8_upper(pc.utf8_trim_whitespace(tbl[col].cast(pa.large_string())))
+            tbl = tbl.set_column(tbl.schema.get_field_index(col), col, texto)
 
-    # REGRA 3: GARANTIA DE TIPOS NUMÉRICOS
+    # REGRA 3: GARANTIA DE TIPOS NUMÉRICOS (ano cabe em int16 e mes em int8)
     for num_col in ['ano', 'mes']:
-        if num_col in df_silver.columns:
-            df_silver[num_col] = pd.to_numeric(df_silver[num_col], errors='coerce').astype('Int64')
+        if num_col in tbl.column_names:
+            numeros = pc.cast(tbl[num_col], PARTITIONING.schema.field(num_col).type, safe=False)
+            tbl = tbl.set_column(tbl.schema.get_field_index(num_col), num_col, numeros)
 
     # --- Testes de Qualidade ---
     try:
-        run_data_quality_tests(df_silver)
+        run_data_quality_tests(tbl)
     except AssertionError as e:
         print(f" Teste de Qualidade Falhou: {e}")
         print("Processamento Silver interrompido devido à baixa qualidade dos dados.")
         return
 
     # --- Análise Exploratória Simples ---
+    # Calculada direto na tabela Arrow: nenhuma cópia em pandas é criada
     print("\nAnálise Exploratória:")
-    print("Total de linhas:", len(df_silver))
-    print("Total de órgãos únicos:", df_silver['nome_orgao'].nunique() if 'nome_orgao' in df_silver else 0)
+    print("Total de linhas:", tbl.num_rows)
+    print("Total de órgãos únicos:", pc.count_distinct(tbl['nome_orgao']).as_py() if 'nome_orgao' in tbl.column_names else 0)
     print("Faixa de datas:", 
-      df_silver['data_pagamento'].min() if 'data_pagamento' in df_silver else 'N/A', 
+      pc.min(tbl['data_pagamento']).as_py() if 'data_pagamento' in tbl.column_names else 'N/A', 
       "→", 
-      df_silver['data_pagamento'].max() if 'data_pagamento' in df_silver else 'N/A')
-    print("Valor médio de pagamento:", round(df_silver['valor'].mean(), 2))
+      pc.max(tbl['data_pagamento']).as_py() if 'data_pagamento' in tbl.column_names else 'N/A')
+    print("Valor médio de pagamento:", round(pc.mean(tbl['valor']).as_py(), 2))
+
+    # Converte data_pagamento (melhorando o tipo de dado); datas inválidas viram nulas
+    if 'data_pagamento' in tbl.column_names:
+        datas = pc.strptime(
+            tbl['data_pagamento'].cast(pa.large_string()), format='%Y-%m-%d', unit='us', error_is_null=True
+        )
+        tbl = tbl.set_column(tbl.schema.get_field_index('data_pagamento'), 'data_pagamento', datas)
 
-    # Converte data_pagamento (melhorando o tipo de dado)
-    if 'data_pagamento' in df_silver.columns:
-        df_silver['data_pagamento'] = pd.to_datetime(df_silver['data_pagamento'], errors='coerce')
 
+    # Ordena por data dentro de cada partição para que o min/max de cada row group seja estreito
+    if 'data_pagamento' in tbl.column_names:
+        tbl = tbl.sort_by([('ano', 'ascending'), ('mes', 'ascending'), ('data_pagamento', 'ascending')])
 
     # --- Gravação ---
     print(f"Salvando dados limpos na camada Silver ({SILVER_PATH})...")
     try:
-        df_silver.to_parquet(
+        # A Silver é refeita por inteiro a partir da Bronze
+        _write_layer(
+            tbl,
             SILVER_PATH,
-            engine='pyarrow',
-            compression='snappy',
-            partition_cols=['ano', 'mes']
+            # Na Silver os nomes (órgão, favorecido...) já padronizados se repetem muito.
+            # As estatísticas (min/max) por row group permitem pular grupos em leituras filtradas.
+            file_options=ds.ParquetFileFormat().make_write_options(
+                compression='zstd', compression_level=3, use_dictionary=True,
+                write_statistics=True, data_page_version="2.0"
+            ),
+            max_rows_per_file=1_000_000,
+            min_rows_per_group=128_000,
+            max_rows_per_group=256_000
         )
         print(" Processamento para Silver concluído com sucesso!")
+        return True
     except Exception as e:
         print(f"Erro ao salvar arquivo Parquet na camada Silver: {e}")
 
 
-def process_silver_to_gold():
+def process_silver_to_gold(particoes=None):
     """
     Lê dados da camada Silver (limpos), aplica agregações de negócio
     e salva na camada Gold (pronto para BI).
+
+    Se `particoes` (conjunto de pares (ano, mes)) for informado, só essas
+    partições da Gold são recalculadas; com None, a Gold inteira é refeita.
     """
-    import pyarrow.dataset as ds
-    import pandas as pd
+    import duckdb
 
     print("\n--- CAMADA GOLD ---")
     print("Iniciando processamento para a camada Gold (Agregação e Valor de Negócio)...")
 
+    # Sem Gold gravada ainda, não há o que atualizar incrementalmente
+    if particoes is not None and not any(GOLD_PATH.rglob("*.parquet")):
+        particoes = None
+
+    if particoes is not None and not particoes:
+        print("Nenhuma partição alterada. Camada Gold já está atualizada.")
+        return
+
+    # A leitura e a agregação rodam no DuckDB direto sobre os Parquets da Silver:
+    # projeção e filtros são empurrados para o scan e a tabela nunca é materializada em Python
+    con = duckdb.connect()
+    silver_glob = str(SILVER_PATH / "**" / "*.parquet").replace("'", "''")
+    silver = f"read_parquet('{silver_glob}', hive_partitioning = true)"
+
     try:
         #  Lê as partições e recupera 'ano' e 'mes' das pastas
-        dataset = ds.dataset(SILVER_PATH, format="parquet", partitioning="hive")
-        table = dataset.to_table()
-        table = table.combine_chunks()
-        df = table.to_pandas()
-        print(f"Registros lidos da camada Silver: {len(df)}")
-    except Exception as e:
+        colunas = [row[0] for row in con.sql(f"DESCRIBE SELECT * FROM {silver}").fetchall()]
+    except duckdb.Error as e:
         print(f"Erro ao ler dados da camada Silver: {e}")
         return
 
-    print("Colunas disponíveis na Silver:", df.columns.tolist())
+    print("Colunas disponíveis na Silver:", colunas)
 
-    # Verifica se 'ano', 'mes', 'nome_orgao' e 'valor' estão no DataFrame
-    required_cols = {'ano', 'mes', 'nome_orgao', 'valor'}
-    if not required_cols.issubset(df.columns):
-        print(f"As colunas esperadas {required_cols} não foram encontradas no dataframe Silver.")
+    # Verifica se 'ano', 'mes', 'nome_orgao' e 'valor' estão na Silver
+    required_cols = ['ano', 'mes', 'nome_orgao', 'valor']
+    if not set(required_cols).issubset(colunas):
+        print(f"As colunas esperadas {required_cols} não foram encontradas no dataset Silver.")
         return
 
-    print("Criando artefato de dados: gastos_agregados_por_orgao...")
+    # Só as partições alteradas são lidas
+    filtro = ""
+    if particoes is not None:
+        pares = sorted(particoes)
+        con.register("particoes_alteradas", pa.table({
+            'ano': [ano for ano, _ in pares],
+            'mes': [mes for _, mes in pares]
+        }))
+        filtro = "WHERE (ano, mes) IN (SELECT ano, mes FROM particoes_alteradas)"
+        print(f"Recalculando {len(particoes)} partição(ões) da Gold...")
 
-    # Agregação por órgão, ano e mês
-    df_gold = (
-        df.groupby(['ano', 'mes', 'nome_orgao'], as_index=False)['valor']
-        .sum()
-        .rename(columns={'valor': 'total_gasto'})
-    )
+    try:
+        total_registros = con.sql(f"SELECT COUNT(*) FROM {silver} {filtro}").fetchone()[0]
+        print(f"Registros lidos da camada Silver: {total_registros}")
+
+        print("Criando artefato de dados: gastos_agregados_por_orgao...")
+
+        # Agregação por órgão, ano e mês
+        table_gold = con.sql(f"""
+            SELECT
+                CAST(ano AS SMALLINT) AS ano,
+                CAST(mes AS TINYINT) AS mes,
+                nome_orgao,
+                SUM(valor) AS total_gasto
+            FROM {silver}
+            {filtro}
+            GROUP BY 1, 2, 3
+        """).to_arrow_table()
+    except duckdb.Error as e:
+        print(f"Erro ao agregar dados da camada Silver: {e}")
+        return
 
-    print(f"Linhas agregadas na camada Gold: {len(df_gold)}")
+    print(f"Linhas agregadas na camada Gold: {table_gold.num_rows}")
 
     # --- Gravação ---
     print(f"Salvando artefato de dados na camada Gold ({GOLD_PATH})...")
+    write_options = dict(
+        file_options=ds.ParquetFileFormat().make_write_options(compression='zstd', compression_level=3),
+        basename_template="part-{i}.parquet",
+        max_rows_per_file=1_000_000,
+        max_rows_per_group=1_000_000
+    )
     try:
-        df_gold.to_parquet(
-            GOLD_PATH,
-            engine='pyarrow',
-            compression='snappy',
-            partition_cols=['ano', 'mes']
-        )
+        if particoes is None:
+            # Gold refeita por inteiro: partições que não existem mais na Silver não sobram
+            _write_layer(table_gold, GOLD_PATH, **write_options)
+        else:
+            ds.write_dataset(
+                table_gold,
+                GOLD_PATH,
+                format="parquet",
+                partitioning=PARTITIONING,
+                # Apenas as partições gravadas agora são substituídas; as demais ficam intactas
+                existing_data_behavior="delete_matching",
+                **write_options
+            )
+
+            # Partições alteradas que ficaram sem registros na Silver são removidas
+            for ano, mes in particoes - _partitions_of(table_gold):
+                shutil.rmtree(GOLD_PATH / f"ano={ano}" / f"mes={mes}", ignore_errors=True)
+                ano_dir = GOLD_PATH / f"ano={ano}"
+                if ano_dir.exists() and not any(ano_dir.iterdir()):
+                    ano_dir.rmdir()
+
+        # Só agora as partições deixam de estar pendentes: se algo falhar antes,
+        # a próxima execução recalcula essas partições mesmo sem nada novo na API
+        _clear_pending_gold_partitions()
+
         print(" Processamento para Gold concluído com sucesso")
         print(f"Dados salvos em: {GOLD_PATH}")
     except Exception as e:
@@ -326,9 +718,11 @@ def process_silver_to_gold():
 if __name__ == "__main__":
     print("--- Iniciando o Pipeline de Dados ELT (Brasil.IO) ---")
 
-    fetch_and_save_raw_data()
-    process_raw_to_bronze()
-    process_bronze_to_silver()
-    process_silver_to_gold()
+    particoes_alteradas = fetch_and_save_raw_data()
+    # A Gold só é atualizada a partir de uma Bronze e de uma Silver gravadas nesta execução
+    if process_raw_to_bronze() and process_bronze_to_silver():
+        process_silver_to_gold(particoes_alteradas)
+    else:
+        print("\nCamada Gold não atualizada; as partições alteradas continuam pendentes.")
 
     print("\n--- Pipeline de dados ELT concluído com sucesso! ---")